@@ -1,28 +1,51 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 import os
-import json
+import orjson
 import hashlib
 import tempfile
 import subprocess
 from datetime import datetime, timedelta
 import asyncio
 import aiohttp
+import aiofiles
+from cachetools import TTLCache
 import base64
 from pathlib import Path
 import shutil
 import re
 import sys
+import math
+import contextlib
+import threading
+import heapq
+from operator import itemgetter
+from collections import OrderedDict, defaultdict, deque
 import numpy as np
 from PIL import Image
 import torch
 import open_clip
+from torchvision.transforms import v2 as T
 import io
+import logging
 
-app = FastAPI(title="Clip Finder API - IMPROVED with Search Type Toggle")
+# Diagnostics go through logging: search-path detail is DEBUG, so it costs nothing at the default level
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("clipfinder")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # JIT-compile the CPU search kernel in a worker thread so no request pays for it
+    await asyncio.to_thread(get_numba_topk_cosine)
+    yield
+
+app = FastAPI(title="Clip Finder API - IMPROVED with Search Type Toggle", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -40,18 +63,55 @@ CLIPS_DIR = BASE_DIR / "clips"
 CACHE_DIR = BASE_DIR / "cache"
 LANCEDB_DIR = BASE_DIR / "lancedb_data"
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # stream uploads to disk 1MB at a time
 RATE_LIMIT = 5  # requests per day per IP
+FRAME_DECODE_SIZE = 640  # frames are decoded to fit 640x640: the thumbnail size, and ample for CLIP's 224px crop
+HYBRID_SCORE_MARGIN = 0.05  # hybrid keeps both the text and visual hit of a half-second window when this close
+FRAME_CACHE_CONTROL = "public, max-age=86400, immutable"  # extracted frames never change
+
+# ANN search profiles for LanceDB vector queries (nprobes / refine_factor)
+ANN_PROFILES = {
+    "fast": {"nprobes": 8, "refine_factor": 1},
+    "balanced": {"nprobes": 16, "refine_factor": 4},
+    "recall-max": {"nprobes": 64, "refine_factor": 10},
+}
+ANN_PROFILE = os.environ.get("ANN_PROFILE", "balanced")
+ANN_MIN_ROWS = 256  # IVF_PQ needs at least 256 rows to train the PQ codebook
+PQ_MIN_FRAMES = 1024  # train a per-video faiss PQ index (64 bytes/frame) above this many frames
+PQ_RERANK = 100  # PQ candidates re-scored exactly against the fp16 matrix
+NUMBA_SCORE_SENTINEL = -2.0  # below any cosine similarity; marks empty slots in the numba top-k kernel
+SIMILARITY_BLOCK_ROWS = 1024  # float16 rows upcast per block when scoring (~2MB of float32 at D=512)
+CLIP_COMPILE = os.environ.get("CLIP_COMPILE", "1") == "1"  # set to 0 on PyTorch builds without torch.compile
+CLIP_ONNX = os.environ.get("CLIP_ONNX", "1") == "1"  # serve CLIP through onnxruntime when installed
+CLIP_INT8 = os.environ.get("CLIP_INT8", "0") == "1"  # opt-in INT8 image encoder on GPUs with INT8 tensor cores
+CLIP_INT8_CALIBRATION_FRAMES = 256  # extracted frames used to calibrate the INT8 image encoder
+ONNX_DIR = CACHE_DIR / "onnx"
+FFMPEG_HWACCEL = os.environ.get("FFMPEG_HWACCEL", "1") == "1"  # NVDEC decode for frame extraction on CUDA hosts
 
 # Create directories
-for dir_path in [UPLOAD_DIR, CLIPS_DIR, CACHE_DIR, LANCEDB_DIR]:
+for dir_path in [UPLOAD_DIR, CLIPS_DIR, CACHE_DIR, ONNX_DIR, LANCEDB_DIR]:
     dir_path.mkdir(exist_ok=True)
-    print(f"Created directory: {dir_path}")
+    logger.debug("Created directory: %s", dir_path)
+
+CLIPS_ROOT = CLIPS_DIR.resolve()  # resolved once; /download-clip paths must stay under it
 
 # In-memory stores
-rate_limit_store = {}
-search_history = {}
-bookmarks = {}
+# Per-(IP, day) upload counters; entries expire after a day so the store stays bounded
+rate_limit_store = TTLCache(maxsize=100_000, ttl=86400)
+rate_limit_lock = asyncio.Lock()
+# Per-video capped deques: the oldest entries drop off instead of growing without bound
+SEARCH_HISTORY_SIZE = 200
+BOOKMARKS_SIZE = 500
+search_history = defaultdict(lambda: deque(maxlen=SEARCH_HISTORY_SIZE))
+bookmarks = defaultdict(lambda: deque(maxlen=BOOKMARKS_SIZE))
 clip_preview_cache = {}
+processing_videos = set()  # video ids with a pipeline running in this process
+clip_jobs = {}  # clip filename -> in-flight ffmpeg task, shared by identical /create-clip requests
+query_embedding_cache = OrderedDict()  # (encoder, search query) -> normalized embedding (LRU)
+query_embedding_lock = asyncio.Lock()
+QUERY_CACHE_SIZE = 1024
+video_data_cache = OrderedDict()  # video_id -> parsed metadata + mmapped embedding matrices (LRU)
+VIDEO_CACHE_SIZE = 8
 
 # Global model cache
 _text_embedding_model = None
@@ -60,6 +120,12 @@ _clip_model = None
 _clip_preprocess = None
 _clip_tokenizer = None
 _lancedb_connection = None
+_clip_onnx_sessions = None
+# CLIP is loaded from worker threads (ingest, hybrid search); re-entrant since the ONNX loader loads the model
+_clip_load_lock = threading.RLock()
+_clip_compiled = False  # torch.compile only runs once we know onnxruntime won't serve CLIP
+_turbojpeg = None  # TurboJPEG decoder, or False when libjpeg-turbo is unavailable
+_numba_topk_cosine = None  # (kernel, fp16 lookup table), or False when numba is not installed
 
 # Models
 class SearchQuery(BaseModel):
@@ -91,48 +157,91 @@ class ProcessingStatus(BaseModel):
     message: str
 
 # Helper functions
-def check_rate_limit(ip: str) -> bool:
+async def check_rate_limit(ip: str) -> bool:
     """Check if IP has exceeded rate limit"""
     today = datetime.now().date()
     key = f"{ip}:{today}"
     
-    if key not in rate_limit_store:
-        rate_limit_store[key] = 0
-    
-    if rate_limit_store[key] >= RATE_LIMIT:
-        return False
-    
-    rate_limit_store[key] += 1
-    return True
+    async with rate_limit_lock:
+        used = rate_limit_store.get(key, 0)
+        if used >= RATE_LIMIT:
+            return False
+        
+        rate_limit_store[key] = used + 1
+        return True
 
-def get_rate_limit_remaining(ip: str) -> int:
+async def get_rate_limit_remaining(ip: str) -> int:
     """Get remaining requests for IP"""
     today = datetime.now().date()
     key = f"{ip}:{today}"
-    used = rate_limit_store.get(key, 0)
+    
+    async with rate_limit_lock:
+        used = rate_limit_store.get(key, 0)
     return max(0, RATE_LIMIT - used)
 
+def write_json(path: Path, obj):
+    """Serialize to JSON with orjson (numpy arrays are written natively)"""
+    Path(path).write_bytes(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+
+def read_json(path: Path):
+    """Parse a JSON file with orjson"""
+    return orjson.loads(Path(path).read_bytes())
+
 def generate_video_id(filename: str) -> str:
     """Generate unique video ID"""
     timestamp = datetime.now().isoformat()
     return hashlib.md5(f"{filename}{timestamp}".encode()).hexdigest()[:16]
 
-def check_ffmpeg():
+async def run_ffmpeg(cmd: List[str], timeout: float) -> subprocess.CompletedProcess:
+    """Run an ffmpeg command without blocking the event loop.
+    
+    Only errors are logged by ffmpeg, and stderr is decoded only when the command fails.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        cmd[0], "-hide_banner", "-loglevel", "error", *cmd[1:],
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    
+    try:
+        _, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except asyncio.CancelledError:
+        # Don't leave ffmpeg writing output behind a cancelled pipeline
+        proc.kill()
+        await proc.wait()
+        raise
+    
+    stderr_text = stderr.decode(errors="replace") if proc.returncode != 0 else ""
+    return subprocess.CompletedProcess(cmd, proc.returncode, stderr=stderr_text)
+
+async def to_thread_to_completion(func, /, *args, **kwargs):
+    """asyncio.to_thread that, if cancelled, still waits for the thread before re-raising.
+    
+    Threads cannot be interrupted, so this keeps a cancelled pipeline branch from leaving work
+    (and file writes) running behind it.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
+
+async def check_ffmpeg():
     """Check if ffmpeg is installed"""
     try:
-        result = subprocess.run(
-            ["ffmpeg", "-version"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
+        result = await run_ffmpeg(["ffmpeg", "-version"], timeout=5)
         return result.returncode == 0
     except (FileNotFoundError, subprocess.TimeoutExpired):
         return False
 
-def extract_audio(video_path: str, audio_path: str):
+async def extract_audio(video_path: str, audio_path: str):
     """Extract audio from video using ffmpeg"""
-    if not check_ffmpeg():
+    if not await check_ffmpeg():
         raise Exception("FFmpeg not installed or not in PATH")
     
     cmd = [
@@ -143,64 +252,70 @@ def extract_audio(video_path: str, audio_path: str):
     ]
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        result = await run_ffmpeg(cmd, timeout=300)
         if result.returncode != 0:
-            print(f"FFmpeg stderr: {result.stderr}")
+            logger.debug("FFmpeg stderr: %s", result.stderr)
             raise Exception(f"Audio extraction failed: {result.stderr}")
     except subprocess.TimeoutExpired:
         raise Exception("Audio extraction timed out")
 
 def transcribe_audio(audio_path: str) -> List[dict]:
-    """Transcribe audio using Whisper"""
+    """Transcribe audio using faster-whisper (CTranslate2)"""
     global _whisper_model
     
     try:
-        import whisper
+        from faster_whisper import WhisperModel
         
         if _whisper_model is None:
-            print("Loading Whisper model (small)...")
-            _whisper_model = whisper.load_model("small")
-        
-        print(f"Transcribing audio from: {audio_path}")
-        
-        result = _whisper_model.transcribe(
-            str(audio_path), 
-            language="en", 
-            fp16=False,
+            logger.info("Loading faster-whisper model (small)...")
+            if torch.cuda.is_available():
+                _whisper_model = WhisperModel("small", device="cuda", compute_type="int8_float16")
+            else:
+                _whisper_model = WhisperModel("small", device="cpu", compute_type="int8")
+        
+        logger.debug("Transcribing audio from: %s", audio_path)
+        
+        # VAD filter skips silence so the decoder only runs on speech
+        segments_iter, _ = _whisper_model.transcribe(
+            str(audio_path),
+            language="en",
             word_timestamps=True,
-            verbose=False
+            vad_filter=True
         )
         
         segments = []
-        for segment in result["segments"]:
-            text = segment["text"].strip()
+        for segment in segments_iter:
+            text = segment.text.strip()
             if len(text) < 3:
                 continue
                 
             segments.append({
-                "start": segment["start"],
-                "end": segment["end"],
+                "start": segment.start,
+                "end": segment.end,
                 "text": text,
-                "words": segment.get("words", [])
+                "words": [
+                    {"word": w.word, "start": w.start, "end": w.end, "probability": w.probability}
+                    for w in (segment.words or [])
+                ]
             })
         
-        print(f"Transcribed {len(segments)} segments")
+        logger.info("Transcribed %d segments", len(segments))
         return segments
         
     except ImportError:
-        print("Whisper not installed - using dummy transcription")
+        logger.warning("faster-whisper not installed - using dummy transcription")
         return [
             {"start": 0, "end": 10, "text": "Welcome to the video.", "words": []},
             {"start": 10, "end": 20, "text": "Main topic discussion.", "words": []},
             {"start": 20, "end": 30, "text": "Examples and demonstrations.", "words": []},
         ]
     except Exception as e:
-        print(f"Transcription error: {e}")
+        logger.error("Transcription error: %s", e)
         return [{"start": 0, "end": 10, "text": f"Transcription error: {str(e)}", "words": []}]
 
-def extract_frames(video_path: str, output_dir: str, interval: int = 1):
+async def extract_frames(video_path: str, output_dir: str, interval: int = 1):
     """Extract frames from video at specified intervals - EVERY 1 SECOND for better accuracy"""
-    if not check_ffmpeg():
+    if not await check_ffmpeg():
         raise Exception("FFmpeg not installed")
     
     os.makedirs(output_dir, exist_ok=True)
@@ -213,46 +328,318 @@ def extract_frames(video_path: str, output_dir: str, interval: int = 1):
         f"{output_dir}/frame_%05d.jpg", "-y"
     ]
     
+    if FFMPEG_HWACCEL and torch.cuda.is_available():
+        # Decode on NVDEC; only frames surviving the fps filter are copied back to the CPU
+        hw_cmd = [
+            "ffmpeg", "-hwaccel", "cuda", "-hwaccel_output_format", "cuda",
+            "-i", str(video_path),
+            "-vf", f"fps=1/{interval},hwdownload,format=nv12",
+            "-q:v", "2",
+            f"{output_dir}/frame_%05d.jpg", "-y"
+        ]
+        try:
+            result = await run_ffmpeg(hw_cmd, timeout=300)
+            if result.returncode == 0:
+                frames = sorted(Path(output_dir).glob("frame_*.jpg"))
+                logger.info("Extracted %d frames from video (NVDEC)", len(frames))
+                return frames
+            logger.warning("NVDEC frame extraction failed, retrying on CPU: %s", result.stderr)
+        except subprocess.TimeoutExpired:
+            logger.warning("NVDEC frame extraction timed out, retrying on CPU")
+    
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        result = await run_ffmpeg(cmd, timeout=300)
         if result.returncode != 0:
-            print(f"Frame extraction warning: {result.stderr}")
+            logger.warning("Frame extraction warning: %s", result.stderr)
             
         # Get list of extracted frames
         frames = sorted(Path(output_dir).glob("frame_*.jpg"))
-        print(f"Extracted {len(frames)} frames from video")
+        logger.info("Extracted %d frames from video", len(frames))
         return frames
         
     except subprocess.TimeoutExpired:
-        print("Frame extraction timed out")
+        logger.error("Frame extraction timed out")
         return []
 
 def get_openclip_model():
     """Load OpenCLIP model"""
     global _clip_model, _clip_preprocess, _clip_tokenizer
     
-    if _clip_model is None:
-        print("Loading OpenCLIP model (ViT-B-32 with laion2b_s34b_b79k weights)...")
+    if _clip_model is not None:
+        return _clip_model, _clip_preprocess, _clip_tokenizer
+    
+    with _clip_load_lock:
+        if _clip_model is not None:
+            return _clip_model, _clip_preprocess, _clip_tokenizer
+        
+        logger.info("Loading OpenCLIP model (ViT-B-32 with laion2b_s34b_b79k weights)...")
         device = "cuda" if torch.cuda.is_available() else "cpu"
         
         try:
-            _clip_model, _, _clip_preprocess = open_clip.create_model_and_transforms(
+            model, _, preprocess = open_clip.create_model_and_transforms(
                 'ViT-B-32',
                 pretrained='laion2b_s34b_b79k',
                 device=device
             )
-            _clip_tokenizer = open_clip.get_tokenizer('ViT-B-32')
+            tokenizer = open_clip.get_tokenizer('ViT-B-32')
+            
+            model.eval()
             
-            _clip_model.eval()
+            # Half precision doubles ViT throughput on tensor-core GPUs
+            if device == "cuda":
+                model = model.half()
             
-            print(f"OpenCLIP model loaded on {device}")
+            logger.info("OpenCLIP model loaded on %s", device)
             
         except Exception as e:
-            print(f"Error loading OpenCLIP: {e}")
+            logger.error("Error loading OpenCLIP: %s", e)
             raise Exception("Failed to load OpenCLIP model. Install with: pip install open-clip-torch")
+        
+        # Publish the model last: other threads only check _clip_model
+        _clip_preprocess, _clip_tokenizer = preprocess, tokenizer
+        _clip_model = model
     
     return _clip_model, _clip_preprocess, _clip_tokenizer
 
+def compile_openclip_model(model, device: str):
+    """Compile the CLIP encoders with torch.compile and warm them up"""
+    try:
+        model.encode_image = torch.compile(model.encode_image, mode="reduce-overhead", fullgraph=False)
+        model.encode_text = torch.compile(model.encode_text, mode="reduce-overhead", fullgraph=False)
+        
+        # Warmup so the first user request doesn't pay the compilation cost
+        logger.info("Compiling OpenCLIP encoders (warmup)...")
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        dummy_image = torch.zeros(1, 3, 224, 224, device=device, dtype=dtype)
+        dummy_text = open_clip.get_tokenizer('ViT-B-32')(["warmup"]).to(device)
+        with torch.no_grad(), clip_autocast():
+            model.encode_image(dummy_image)
+            model.encode_text(dummy_text)
+        
+        logger.info("OpenCLIP encoders compiled")
+    except Exception as e:
+        logger.warning("torch.compile unavailable, using eager mode: %s", e)
+        # Drop the compiled wrappers so the class methods are used again
+        model.__dict__.pop("encode_image", None)
+        model.__dict__.pop("encode_text", None)
+
+class _ClipImageEncoder(torch.nn.Module):
+    """Wraps the (uncompiled) CLIP image tower for ONNX export"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, image):
+        return type(self.model).encode_image(self.model, image)
+
+class _ClipTextEncoder(torch.nn.Module):
+    """Wraps the (uncompiled) CLIP text tower for ONNX export"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, text):
+        return type(self.model).encode_text(self.model, text)
+
+def export_openclip_onnx(model, device: str) -> Dict[str, Path]:
+    """Export the CLIP image and text encoders to ONNX (once, cached in ONNX_DIR)"""
+    precision = "fp16" if device == "cuda" else "fp32"
+    paths = {
+        "visual": ONNX_DIR / f"clip_vit_b32_visual_{precision}.onnx",
+        "text": ONNX_DIR / f"clip_vit_b32_text_{precision}.onnx",
+    }
+    
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    dummy_inputs = {
+        "visual": (_ClipImageEncoder(model), torch.zeros(1, 3, 224, 224, device=device, dtype=dtype)),
+        "text": (_ClipTextEncoder(model), open_clip.get_tokenizer('ViT-B-32')(["export"]).to(device)),
+    }
+    
+    for kind, path in paths.items():
+        if path.exists():
+            continue
+        
+        logger.info("Exporting CLIP %s encoder to ONNX: %s", kind, path)
+        encoder, dummy = dummy_inputs[kind]
+        # Export beside the target and rename, so an interrupted export never leaves a file that exists()
+        tmp_path = path.with_suffix(".onnx.tmp")
+        torch.onnx.export(
+            encoder,
+            dummy,
+            str(tmp_path),
+            input_names=["input"],
+            output_names=["output"],
+            opset_version=17,
+            dynamic_axes={"input": {0: "B"}, "output": {0: "B"}}
+        )
+        os.replace(tmp_path, path)
+    
+    return paths
+
+def supports_int8_tensor_cores() -> bool:
+    """INT8 tensor cores are available from Turing (sm_75) onwards"""
+    return torch.cuda.is_available() and torch.cuda.get_device_capability() >= (7, 5)
+
+def clip_int8_calibration_data() -> Optional[np.ndarray]:
+    """Preprocessed (N, 3, 224, 224) fp16 batch of real extracted frames for INT8 calibration, or None if too few"""
+    frame_paths = sorted(UPLOAD_DIR.glob("*_frames/frame_*.jpg"))
+    if len(frame_paths) < CLIP_INT8_CALIBRATION_FRAMES // 4:
+        return None
+    
+    # Spread the sample across all processed videos
+    step = max(1, len(frame_paths) // CLIP_INT8_CALIBRATION_FRAMES)
+    frames = [
+        preprocess_frames_on_device(torch.from_numpy(decode_image_rgb(str(path))).permute(2, 0, 1).unsqueeze(0), "cpu")
+        for path in frame_paths[::step][:CLIP_INT8_CALIBRATION_FRAMES]
+    ]
+    return torch.cat(frames).half().numpy()
+
+def quantize_clip_visual_int8(fp_path: Path) -> Optional[Path]:
+    """Post-training INT8 quantization of the exported CLIP image encoder, calibrated on real frames (cached)"""
+    int8_path = ONNX_DIR / "clip_vit_b32_visual_int8_calibrated.onnx"
+    if int8_path.exists():
+        return int8_path
+    
+    try:
+        from modelopt.onnx.quantization import quantize
+        
+        # Without real frames modelopt would calibrate on random tensors; stay on fp16 until there are some
+        calibration_data = clip_int8_calibration_data()
+        if calibration_data is None:
+            logger.warning("Not enough processed frames to calibrate INT8 - keeping fp16 image encoder")
+            return None
+        
+        logger.info("Quantizing CLIP image encoder to INT8 (%d calibration frames)...", len(calibration_data))
+        tmp_path = int8_path.with_suffix(".onnx.tmp")
+        quantize(
+            onnx_path=str(fp_path),
+            quantize_mode="int8",
+            calibration_data={"input": calibration_data},
+            high_precision_dtype="fp16",
+            op_types_to_exclude=["Add"],
+            output_path=str(tmp_path)
+        )
+        os.replace(tmp_path, int8_path)
+        return int8_path
+        
+    except ImportError:
+        logger.warning("nvidia-modelopt not installed - keeping fp16 image encoder")
+    except Exception as e:
+        logger.warning("INT8 quantization failed, keeping fp16 image encoder: %s", e)
+    
+    return None
+
+def get_clip_onnx_sessions() -> Optional[dict]:
+    """Lazily export CLIP to ONNX and open onnxruntime sessions. Returns None if unavailable."""
+    global _clip_onnx_sessions
+    
+    if _clip_onnx_sessions is not None:
+        return _clip_onnx_sessions or None
+    
+    with _clip_load_lock:
+        # Another thread may have loaded them while we waited; only one ever exports
+        if _clip_onnx_sessions is None:
+            _clip_onnx_sessions = load_clip_onnx_sessions()
+    
+    return _clip_onnx_sessions or None
+
+def load_clip_onnx_sessions() -> dict:
+    """Export CLIP to ONNX (cached) and open onnxruntime sessions; {} if unavailable. Call under _clip_load_lock."""
+    if not CLIP_ONNX:
+        return {}
+    
+    try:
+        import onnxruntime as ort
+        
+        model, _, _ = get_openclip_model()
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        paths = export_openclip_onnx(model, device)
+        
+        # Prefer TensorRT (engines cached next to the ONNX files), then CUDA, then CPU
+        available = ort.get_available_providers()
+        providers = []
+        if "TensorrtExecutionProvider" in available:
+            providers.append(("TensorrtExecutionProvider", {
+                "trt_fp16_enable": True,
+                "trt_engine_cache_enable": True,
+                "trt_engine_cache_path": str(ONNX_DIR)
+            }))
+        if "CUDAExecutionProvider" in available:
+            providers.append("CUDAExecutionProvider")
+        providers.append("CPUExecutionProvider")
+        
+        sessions = {
+            kind: ort.InferenceSession(str(path), providers=providers)
+            for kind, path in paths.items()
+        }
+        
+        # INT8 image encoder only pays off through TensorRT on INT8-capable GPUs
+        if CLIP_INT8 and "TensorrtExecutionProvider" in available and supports_int8_tensor_cores():
+            int8_path = quantize_clip_visual_int8(paths["visual"])
+            if int8_path is not None:
+                trt_options = dict(providers[0][1], trt_int8_enable=True)
+                sessions["visual"] = ort.InferenceSession(
+                    str(int8_path),
+                    providers=[("TensorrtExecutionProvider", trt_options)] + providers[1:]
+                )
+                logger.info("Using INT8 CLIP image encoder")
+        logger.info("OpenCLIP served via onnxruntime (%s)", sessions['visual'].get_providers()[0])
+        return sessions
+        
+    except ImportError:
+        logger.warning("onnxruntime not installed - using PyTorch for OpenCLIP")
+    except Exception as e:
+        logger.warning("ONNX export failed, using PyTorch for OpenCLIP: %s", e)
+    
+    return {}
+
+def get_torch_clip_model():
+    """OpenCLIP model for the PyTorch path, compiled (once) when CLIP_COMPILE is set"""
+    global _clip_compiled
+    
+    model, _, _ = get_openclip_model()
+    if CLIP_COMPILE and not _clip_compiled and hasattr(torch, "compile"):
+        with _clip_load_lock:
+            if not _clip_compiled:
+                compile_openclip_model(model, "cuda" if torch.cuda.is_available() else "cpu")
+                _clip_compiled = True
+    return model
+
+def run_clip_encoder(kind: str, inputs: torch.Tensor) -> torch.Tensor:
+    """Run the "visual" or "text" CLIP encoder through onnxruntime, or PyTorch as a fallback"""
+    sessions = get_clip_onnx_sessions()
+    
+    if sessions is not None:
+        session = sessions[kind]
+        feed = inputs.cpu().numpy()
+        if session.get_inputs()[0].type == "tensor(float16)":
+            feed = feed.astype(np.float16)
+        outputs = session.run(None, {"input": feed})
+        return torch.from_numpy(outputs[0])
+    
+    model = get_torch_clip_model()
+    with clip_autocast():
+        if kind == "visual":
+            return model.encode_image(inputs)
+        return model.encode_text(inputs)
+
+def run_on_cuda_stream(fn, *args, **kwargs):
+    """Run fn on a dedicated CUDA stream so its kernels can overlap with other GPU work"""
+    if not torch.cuda.is_available():
+        return fn(*args, **kwargs)
+    
+    stream = torch.cuda.Stream()
+    with torch.cuda.stream(stream):
+        result = fn(*args, **kwargs)
+    stream.synchronize()
+    return result
+
+def clip_autocast():
+    """fp16 autocast context on CUDA, no-op on CPU"""
+    if torch.cuda.is_available():
+        return torch.autocast("cuda", dtype=torch.float16)
+    return contextlib.nullcontext()
+
 def get_lancedb():
     """Get or create LanceDB connection"""
     global _lancedb_connection
@@ -261,15 +648,404 @@ def get_lancedb():
         import lancedb
         
         if _lancedb_connection is None:
-            print(f"Connecting to LanceDB at {LANCEDB_DIR}...")
+            logger.info("Connecting to LanceDB at %s...", LANCEDB_DIR)
             _lancedb_connection = lancedb.connect(str(LANCEDB_DIR))
-            print("LanceDB connected successfully")
+            logger.info("LanceDB connected successfully")
         
         return _lancedb_connection
         
     except ImportError:
         raise Exception("lancedb not installed. Run: pip install lancedb")
 
+def create_vector_index(table, num_rows: int):
+    """Build an IVF_PQ cosine index on a LanceDB table (skipped for small tables)"""
+    if num_rows < ANN_MIN_ROWS:
+        logger.debug("Skipping ANN index for %s rows (flat scan is faster)", num_rows)
+        return
+    
+    try:
+        table.create_index(
+            metric="cosine",
+            vector_column_name="vector",
+            index_type="IVF_PQ",
+            num_partitions=max(1, int(math.sqrt(num_rows))),
+            num_sub_vectors=32
+        )
+        logger.info("Created IVF_PQ index over %s vectors", num_rows)
+    except Exception as e:
+        logger.warning("ANN index creation failed, falling back to flat scan: %s", e)
+
+def store_vector_table(table_name: str, rows: List[dict]):
+    """(Re)create a LanceDB table from rows and build its ANN index. Blocking: run it in a worker thread"""
+    try:
+        db = get_lancedb()
+        if table_name in db.table_names():
+            db.drop_table(table_name)
+        table = db.create_table(table_name, data=rows)
+        logger.info("Created LanceDB table: %s", table_name)
+        create_vector_index(table, len(rows))
+    except Exception as e:
+        logger.error("Error creating LanceDB table %s: %s", table_name, e)
+
+def search_vector_table(table_name: str, query_vector: np.ndarray, limit: int) -> Optional[List[dict]]:
+    """Query a LanceDB table by cosine similarity. Returns None if the table is unavailable."""
+    try:
+        db = get_lancedb()
+        if table_name not in db.table_names():
+            return None
+        table = db.open_table(table_name)
+    except Exception as e:
+        logger.warning("LanceDB unavailable for %s: %s", table_name, e)
+        return None
+    
+    profile = ANN_PROFILES.get(ANN_PROFILE, ANN_PROFILES["balanced"])
+    try:
+        hits = (
+            table.search(np.asarray(query_vector, dtype=np.float32))
+            .metric("cosine")
+            .nprobes(profile["nprobes"])
+            .refine_factor(profile["refine_factor"])
+            .limit(limit)
+            .to_list()
+        )
+    except Exception as e:
+        logger.warning("LanceDB query failed for %s: %s", table_name, e)
+        return None
+    
+    # LanceDB returns cosine distance; convert back to similarity
+    for hit in hits:
+        hit["similarity"] = 1.0 - float(hit["_distance"])
+    
+    return hits
+
+def embedding_matrix_path(video_id: str, kind: str) -> Path:
+    """Path of the (N, D) "visual" or "text" embedding matrix for a video"""
+    return CACHE_DIR / f"{video_id}_{kind}.npy"
+
+def save_embedding_matrix(video_id: str, kind: str, embeddings, dim: int) -> np.ndarray:
+    """L2-normalize embeddings into a float16 (N, D) matrix and persist it as .npy"""
+    if len(embeddings):
+        matrix = stack_normalized(embeddings).astype(np.float16)
+    else:
+        matrix = np.empty((0, dim), dtype=np.float16)
+    np.save(embedding_matrix_path(video_id, kind), matrix)
+    return matrix
+
+def load_embedding_matrix(video_id: str, kind: str) -> Optional[np.ndarray]:
+    """Memory-map an embedding matrix, or None if it was never written"""
+    path = embedding_matrix_path(video_id, kind)
+    if not path.exists():
+        return None
+    return np.load(path, mmap_mode="r")
+
+def normalize_vector(vector) -> np.ndarray:
+    """L2-normalize a single vector, so cosine similarity reduces to a dot product"""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.sqrt(np.vdot(vector, vector))
+    return vector / norm if norm > 0 else vector
+
+def stack_normalized(embeddings) -> np.ndarray:
+    """Stack embeddings into a contiguous float32 (N, D) matrix with L2-normalized rows"""
+    matrix = np.array(embeddings, dtype=np.float32)
+    # Row-wise vdot is cheaper than np.linalg.norm's generic path
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))[:, None]
+    matrix /= np.maximum(norms, 1e-12)
+    return matrix
+
+def migrate_inline_embeddings(video_id: str, data: dict, data_file: Path):
+    """One-time move of embeddings stored inline in the JSON (older videos) into .npy files"""
+    visual = [vd.pop("embedding") for vd in data.get("visual_data", []) if "embedding" in vd]
+    text = data.pop("text_embeddings", [])
+    
+    save_embedding_matrix(video_id, "visual", visual, dim=512)
+    save_embedding_matrix(video_id, "text", text, dim=768)
+    write_json(data_file, data)
+    logger.info("Migrated inline embeddings of %s to .npy", video_id)
+
+def load_video_data(video_id: str) -> Optional[dict]:
+    """Processed video metadata with its embedding matrices, cached in-process (LRU)"""
+    if video_id in video_data_cache:
+        video_data_cache.move_to_end(video_id)
+        return video_data_cache[video_id]
+    
+    data_file = CACHE_DIR / f"{video_id}_data.json"
+    if not data_file.exists():
+        return None
+    
+    data = read_json(data_file)
+    
+    visual_data = data.get("visual_data", [])
+    if "text_embeddings" in data or (visual_data and "embedding" in visual_data[0]):
+        migrate_inline_embeddings(video_id, data, data_file)
+    
+    # Frame metadata as struct-of-arrays, parallel to the rows of visual_matrix
+    visual_data = data.pop("visual_data", [])
+    data["frame_timestamps"] = np.array([vd["timestamp"] for vd in visual_data], dtype=np.float64)
+    data["frame_numbers"] = np.array([vd["frame_number"] for vd in visual_data], dtype=np.int32)
+    data["frame_paths"] = [vd["frame_path"] for vd in visual_data]
+    
+    # mmap only reads the .npy header; pages are faulted in by the first search
+    data["visual_matrix"] = load_embedding_matrix(video_id, "visual")
+    data["text_matrix"] = load_embedding_matrix(video_id, "text")
+    data["visual_pq"] = load_pq_index(video_id)
+    
+    # Sorted segment start times for O(log M) timestamp -> segment lookup
+    data["seg_starts"] = np.array([seg["start"] for seg in data.get("segments", [])], dtype=np.float64)
+    # Lowercased once here rather than per segment on every keyword match
+    data["seg_texts_lower"] = [seg["text"].lower() for seg in data.get("segments", [])]
+    
+    video_data_cache[video_id] = data
+    if len(video_data_cache) > VIDEO_CACHE_SIZE:
+        video_data_cache.popitem(last=False)
+    
+    return data
+
+def segment_text_at(data: dict, timestamp: float) -> str:
+    """Transcript text of the segment containing timestamp (binary search over segment starts)"""
+    idx = int(np.searchsorted(data["seg_starts"], timestamp, side="right")) - 1
+    if idx >= 0:
+        seg = data["segments"][idx]
+        if timestamp <= seg["end"]:
+            return seg["text"]
+    return f"Visual content at {timestamp:.1f}s"
+
+def similarity_scores(matrix: np.ndarray, query_vector) -> np.ndarray:
+    """Cosine similarity of every row against the query (rows and query are L2-normalized)"""
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    if matrix.dtype == np.float32:
+        return matrix @ query_vector
+    
+    # Stored as float16 to halve disk/memory traffic. Upcast block by block for the BLAS product,
+    # so only SIMILARITY_BLOCK_ROWS float32 rows exist at a time (cache-resident) instead of a
+    # full float32 copy that would give back the bandwidth float16 saved
+    scores = np.empty(len(matrix), dtype=np.float32)
+    block = np.empty((min(SIMILARITY_BLOCK_ROWS, len(matrix)), matrix.shape[1]), dtype=np.float32)
+    for start in range(0, len(matrix), SIMILARITY_BLOCK_ROWS):
+        rows = matrix[start:start + SIMILARITY_BLOCK_ROWS]
+        buf = block[:len(rows)]
+        buf[...] = rows
+        np.matmul(buf, query_vector, out=scores[start:start + len(rows)])
+    return scores
+
+def keyword_bonus(seg_texts_lower: List[str], query_text: str) -> np.ndarray:
+    """0.3 for every segment containing the query verbatim, else 0 (one pass, no per-segment lower())"""
+    query_lower = query_text.lower()
+    return np.fromiter(
+        (0.3 if query_lower in text else 0.0 for text in seg_texts_lower),
+        dtype=np.float32, count=len(seg_texts_lower)
+    )
+
+def search_text_segments(data: dict, query_embedding, query_text: str, limit: int):
+    """Score transcript segments for a text query, returning (segment indices, combined scores).
+    
+    The LanceDB text table supplies the nearest `limit` segments, plus every segment containing
+    the query verbatim (these get the keyword bonus). Only those candidates are re-scored exactly.
+    Without the table, every segment is scored.
+    """
+    text_matrix = data["text_matrix"]
+    if text_matrix is None:
+        raise Exception("Text embeddings not found")
+    
+    seg_texts_lower = data["seg_texts_lower"]
+    n = min(len(text_matrix), len(seg_texts_lower))
+    bonus = keyword_bonus(seg_texts_lower[:n], query_text)
+    
+    text_table_name = data.get("text_table_name", f"text_{data['video_id']}")
+    hits = search_vector_table(text_table_name, query_embedding, limit)
+    if hits is None:
+        # One SGEMV over every segment, plus the bonus
+        return np.arange(n), similarity_scores(text_matrix[:n], query_embedding) + bonus
+    
+    # Map hits back to segments by their (unique, sorted) start time
+    seg_starts = data["seg_starts"]
+    candidates = set()
+    for hit in hits:
+        idx = int(np.searchsorted(seg_starts, hit["timestamp"]))
+        if idx < len(seg_starts) and seg_starts[idx] == hit["timestamp"]:
+            candidates.add(idx)
+    
+    candidates.update(np.nonzero(bonus)[0].tolist())
+    
+    indices = np.array(sorted(i for i in candidates if i < n), dtype=np.int64)
+    scores = similarity_scores(text_matrix[indices], query_embedding) + bonus[indices]
+    return indices, scores
+
+def pq_index_path(video_id: str) -> Path:
+    """Path of the product-quantized frame index for a video"""
+    return CACHE_DIR / f"{video_id}_visual.faiss"
+
+def build_pq_index(video_id: str, visual_matrix: np.ndarray):
+    """Train and persist a faiss IndexPQ (64 sub-quantizers x 8 bits) over the frame embeddings"""
+    if len(visual_matrix) < PQ_MIN_FRAMES:
+        return
+    
+    try:
+        import faiss
+        
+        vectors = np.ascontiguousarray(visual_matrix, dtype=np.float32)
+        index = faiss.IndexPQ(vectors.shape[1], 64, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        faiss.write_index(index, str(pq_index_path(video_id)))
+        logger.info("Built PQ index over %d frames", len(vectors))
+        
+    except ImportError:
+        logger.warning("faiss not installed - skipping PQ index")
+    except Exception as e:
+        logger.warning("PQ index build failed: %s", e)
+
+def load_pq_index(video_id: str):
+    """Load the faiss PQ index for a video, or None if there is none"""
+    path = pq_index_path(video_id)
+    if not path.exists():
+        return None
+    
+    try:
+        import faiss
+        return faiss.read_index(str(path))
+    except ImportError:
+        return None
+
+def upload_matrix_to_gpu(matrix: Optional[np.ndarray]) -> Optional[torch.Tensor]:
+    """Copy an fp16 embedding matrix to the GPU, or None when CUDA is unavailable"""
+    if matrix is None or len(matrix) == 0 or not torch.cuda.is_available():
+        return None
+    try:
+        return torch.from_numpy(np.ascontiguousarray(matrix, dtype=np.float16)).to("cuda")
+    except Exception as e:
+        logger.warning("Could not upload embeddings to GPU, searching on CPU: %s", e)
+        return None
+
+def get_visual_matrix_gpu(data: dict) -> Optional[torch.Tensor]:
+    """Persistent fp16 GPU copy of a video's frame matrix for brute-force search, uploaded on first use.
+    
+    Kept on the cached data entry (freed when it is evicted), and never created by the metadata-only
+    endpoints or by searches that LanceDB answers.
+    """
+    if "visual_matrix_gpu" not in data:
+        data["visual_matrix_gpu"] = upload_matrix_to_gpu(data["visual_matrix"])
+    return data["visual_matrix_gpu"]
+
+def gpu_similarity_scores(matrix_gpu: torch.Tensor, query_vector) -> torch.Tensor:
+    """Cosine similarity of every row of a GPU-resident fp16 matrix against the query, on device"""
+    query = torch.from_numpy(np.asarray(query_vector, dtype=np.float32)).to(matrix_gpu.device, torch.float16)
+    return (matrix_gpu @ query).float()
+
+# Numba is optional; the kernel is defined at module level so cache=True can persist its compiled code
+try:
+    from numba import njit, prange, get_num_threads
+    
+    # fastmath minus nnan/ninf: reassociation still vectorizes the dot product, and comparisons
+    # against the sentinel stay well defined
+    @njit(parallel=True, cache=True, fastmath={"reassoc", "contract", "nsz", "arcp", "afn"})
+    def _topk_cosine_kernel(matrix, half_table, query, threshold, k, n_chunks):
+        # Numba has no CPU float16, so rows arrive as uint16 bit patterns decoded through half_table
+        n, d = matrix.shape
+        chunk = (n + n_chunks - 1) // n_chunks
+        best_idx = np.full((n_chunks, k), -1, dtype=np.int64)
+        # Finite sentinel below any cosine; callers clamp the threshold above it
+        best_score = np.full((n_chunks, k), NUMBA_SCORE_SENTINEL, dtype=np.float32)
+        for c in prange(n_chunks):
+            worst = 0  # slot of this chunk's lowest kept score
+            for i in range(c * chunk, min(n, (c + 1) * chunk)):
+                s = np.float32(0.0)
+                for j in range(d):
+                    s += half_table[matrix[i, j]] * query[j]
+                if s > threshold and s > best_score[c, worst]:
+                    best_score[c, worst] = s
+                    best_idx[c, worst] = i
+                    for m in range(k):
+                        if best_score[c, m] < best_score[c, worst]:
+                            worst = m
+        return best_idx.ravel(), best_score.ravel()
+    
+except Exception as e:
+    _topk_cosine_kernel = None
+    _numba_import_error = e
+
+def get_numba_topk_cosine():
+    """Numba kernel fusing cosine scoring, thresholding and top-k into one parallel pass over an fp16 matrix"""
+    global _numba_topk_cosine
+    
+    if _numba_topk_cosine is None:
+        if _topk_cosine_kernel is None:
+            logger.info("numba unavailable - using NumPy for CPU frame search: %s", _numba_import_error)
+            _numba_topk_cosine = False
+            return None
+        
+        try:
+            # float32 value of every fp16 bit pattern (256KB, stays cache-resident)
+            half_table = np.arange(1 << 16, dtype=np.uint32).astype(np.uint16).view(np.float16).astype(np.float32)
+            
+            def topk_cosine(matrix, half_table, query, threshold, k):
+                # Thread count is passed in: reading it inside the kernel would make it uncacheable
+                return _topk_cosine_kernel(matrix, half_table, query, threshold, k, get_num_threads())
+            
+            # Compile (or load from the on-disk cache) now rather than on the first search;
+            # called off the event loop at startup. Read-only like the memory-mapped matrices,
+            # so the warmed-up specialization is the one searches use
+            warmup = np.zeros((2, 4), dtype=np.uint16)
+            warmup.setflags(write=False)
+            topk_cosine(warmup, half_table, np.zeros(4, dtype=np.float32), np.float32(0.0), 1)
+            _numba_topk_cosine = (topk_cosine, half_table)
+            logger.info("Compiled numba frame search kernel")
+        except Exception as e:
+            logger.warning("numba kernel compilation failed, using NumPy for CPU frame search: %s", e)
+            _numba_topk_cosine = False
+    
+    return _numba_topk_cosine or None
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first: O(N) partition, then a sort of only k items"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def top_k_frames(visual_matrix: np.ndarray, query_vector: np.ndarray, k: int, pq_index=None, gpu_matrix=None,
+                 threshold: float = -math.inf):
+    """Return (indices, scores) of the k frames most similar to the query scoring above threshold, best first.
+    
+    With the matrix on the GPU, every frame is scored exactly there and torch.topk selects on
+    device. Otherwise, with a PQ index, the asymmetric-distance scan picks PQ_RERANK candidates
+    which are then re-scored exactly; failing both, every frame is scored on the CPU (in one fused
+    numba pass when numba is installed).
+    """
+    if gpu_matrix is not None:
+        scores, top = torch.topk(gpu_similarity_scores(gpu_matrix, query_vector), min(k, len(gpu_matrix)))
+        top, scores = top.cpu().numpy(), scores.cpu().numpy()
+        keep = scores > threshold
+        return top[keep], scores[keep]
+    
+    numba_topk = get_numba_topk_cosine() if pq_index is None else None
+    if numba_topk is not None and visual_matrix.dtype == np.float16 and len(visual_matrix) and k > 0:
+        kernel, half_table = numba_topk
+        candidates, scores = kernel(
+            visual_matrix.view(np.uint16), half_table,
+            np.asarray(query_vector, dtype=np.float32), np.float32(max(threshold, NUMBA_SCORE_SENTINEL + 0.5)), k
+        )
+        # Merge the per-thread top-k lists
+        keep = candidates >= 0
+        candidates, scores = candidates[keep], scores[keep]
+        top = top_k_indices(scores, k)
+        return candidates[top], scores[top]
+    
+    if pq_index is not None:
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        _, candidates = pq_index.search(query, max(k, PQ_RERANK))
+        # Sorted row order keeps the reads from the memory-mapped matrix sequential
+        candidates = np.sort(candidates[0][candidates[0] >= 0])
+        scores = similarity_scores(visual_matrix[candidates], query_vector)
+    else:
+        candidates = np.arange(len(visual_matrix))
+        scores = similarity_scores(visual_matrix, query_vector)
+    
+    keep = np.nonzero(scores > threshold)[0]
+    top = keep[top_k_indices(scores[keep], k)]
+    return candidates[top], scores[top]
+
 async def get_text_embeddings(texts: List[str]) -> List[List[float]]:
     """Get text embeddings using sentence-transformers"""
     global _text_embedding_model
@@ -278,12 +1054,15 @@ async def get_text_embeddings(texts: List[str]) -> List[List[float]]:
         from sentence_transformers import SentenceTransformer
         
         if _text_embedding_model is None:
-            print("Loading sentence transformer model (all-mpnet-base-v2)...")
+            logger.info("Loading sentence transformer model (all-mpnet-base-v2)...")
             _text_embedding_model = SentenceTransformer('all-mpnet-base-v2')
         
-        print(f"Generating embeddings for {len(texts)} texts...")
-        embeddings = _text_embedding_model.encode(
-            texts, 
+        logger.debug("Generating embeddings for %d texts...", len(texts))
+        # Run off the event loop so it can overlap with frame encoding and serve requests
+        embeddings = await to_thread_to_completion(
+            run_on_cuda_stream,
+            _text_embedding_model.encode,
+            texts,
             convert_to_numpy=True,
             show_progress_bar=False,
             normalize_embeddings=True
@@ -292,7 +1071,7 @@ async def get_text_embeddings(texts: List[str]) -> List[List[float]]:
         return embeddings.tolist()
         
     except ImportError:
-        print("sentence-transformers not installed")
+        logger.warning("sentence-transformers not installed")
         import random
         random.seed(42)
         return [[random.random() for _ in range(768)] for _ in texts]
@@ -300,17 +1079,20 @@ async def get_text_embeddings(texts: List[str]) -> List[List[float]]:
 @torch.no_grad()
 def encode_image_with_openclip(image_path: str) -> np.ndarray:
     """Encode image using OpenCLIP model"""
-    model, preprocess, _ = get_openclip_model()
+    get_openclip_model()
     device = "cuda" if torch.cuda.is_available() else "cpu"
     
     # Load and preprocess image
-    image = Image.open(image_path).convert("RGB")
-    image_input = preprocess(image).unsqueeze(0).to(device)
+    image = torch.from_numpy(decode_image_rgb(image_path)).permute(2, 0, 1)
+    image_input = preprocess_frames_on_device(image.unsqueeze(0), device)
+    if device == "cuda":
+        image_input = image_input.half()
     
     # Get image features
-    image_features = model.encode_image(image_input)
+    image_features = run_clip_encoder("visual", image_input)
     
     # Normalize features
+    image_features = image_features.float()
     image_features = image_features / image_features.norm(dim=-1, keepdim=True)
     
     return image_features.cpu().numpy()[0]
@@ -318,26 +1100,258 @@ def encode_image_with_openclip(image_path: str) -> np.ndarray:
 @torch.no_grad()
 def encode_text_with_openclip(text: str) -> np.ndarray:
     """Encode text query using OpenCLIP model - THIS IS THE KEY FOR VISUAL SEARCH"""
-    model, _, tokenizer = get_openclip_model()
+    _, _, tokenizer = get_openclip_model()
     device = "cuda" if torch.cuda.is_available() else "cpu"
     
     # Tokenize text
     text_input = tokenizer([text]).to(device)
     
     # Get text features
-    text_features = model.encode_text(text_input)
+    text_features = run_clip_encoder("text", text_input)
     
     # Normalize features
+    text_features = text_features.float()
     text_features = text_features / text_features.norm(dim=-1, keepdim=True)
     
     return text_features.cpu().numpy()[0]
 
+def get_cached_query_embedding(key: tuple) -> Optional[np.ndarray]:
+    """Look up a query embedding, marking it as recently used"""
+    embedding = query_embedding_cache.get(key)
+    if embedding is not None:
+        query_embedding_cache.move_to_end(key)
+    return embedding
+
+def cache_query_embedding(key: tuple, embedding) -> np.ndarray:
+    """Store a normalized, read-only query embedding, evicting the least recently used one"""
+    embedding = normalize_vector(embedding)
+    embedding.setflags(write=False)  # shared across requests
+    
+    query_embedding_cache[key] = embedding
+    if len(query_embedding_cache) > QUERY_CACHE_SIZE:
+        query_embedding_cache.popitem(last=False)
+    return embedding
+
+async def get_query_clip_embedding(text: str) -> np.ndarray:
+    """CLIP text embedding for a search query, memoized across requests.
+    
+    Only the encode runs in the default executor; the cache is read and written on the event loop
+    thread, so it needs no lock.
+    """
+    embedding = get_cached_query_embedding(("clip", text))
+    if embedding is None:
+        raw = await asyncio.get_running_loop().run_in_executor(None, encode_text_with_openclip, text)
+        embedding = cache_query_embedding(("clip", text), raw)
+    return embedding
+
+async def get_query_text_embedding(text: str) -> np.ndarray:
+    """Sentence-transformers embedding for a search query, memoized across requests"""
+    embedding = get_cached_query_embedding(("text", text))
+    if embedding is not None:
+        return embedding
+    
+    async with query_embedding_lock:
+        # Another request may have filled it while we waited for the lock
+        embedding = get_cached_query_embedding(("text", text))
+        if embedding is None:
+            embeddings = await get_text_embeddings([text])
+            embedding = cache_query_embedding(("text", text), embeddings[0])
+    
+    return embedding
+
+@torch.no_grad()
+def encode_preprocessed_batch(image_batch: torch.Tensor) -> np.ndarray:
+    """Encode an already-preprocessed (B, 3, 224, 224) batch into normalized CLIP features"""
+    if image_batch.is_cuda:
+        image_batch = image_batch.half()
+    
+    features = run_clip_encoder("visual", image_batch)
+    features = features.float()
+    features = features / features.norm(dim=-1, keepdim=True)
+    
+    return features.cpu().numpy()
+
+# CLIP preprocessing as one batched transform over uint8 (B, 3, H, W) tensors
+clip_batch_transform = T.Compose([
+    T.Resize(224, interpolation=T.InterpolationMode.BICUBIC, antialias=True),
+    T.CenterCrop(224),
+    T.ToDtype(torch.float32, scale=True),
+    T.Normalize(open_clip.OPENAI_DATASET_MEAN, open_clip.OPENAI_DATASET_STD),
+])
+
+def preprocess_frames_on_device(frames: torch.Tensor, device: str) -> torch.Tensor:
+    """CLIP preprocessing (resize, center-crop, normalize) on a uint8 (B, 3, H, W) batch, on device"""
+    return clip_batch_transform(frames.to(device, non_blocking=True))
+
+def decode_image_rgb(image_path: str) -> np.ndarray:
+    """Decode an image to an RGB uint8 (H, W, 3) array, using libjpeg-turbo SIMD when available.
+    
+    JPEGs are downscaled inside the decoder (DCT scaling) by the largest power of two that keeps
+    them at least FRAME_DECODE_SIZE on the long side, so full-resolution frames are never expanded.
+    """
+    global _turbojpeg
+    
+    if _turbojpeg is None:
+        # Looked up once: a failed library lookup spawns ldconfig, far too slow to repeat per frame
+        try:
+            from turbojpeg import TurboJPEG
+            _turbojpeg = TurboJPEG()
+        except (ImportError, RuntimeError, OSError) as e:
+            logger.info("libjpeg-turbo unavailable - decoding frames with PIL: %s", e)
+            _turbojpeg = False
+    
+    if _turbojpeg:
+        from turbojpeg import TJPF_RGB
+        
+        try:
+            with open(image_path, "rb") as f:
+                jpeg = f.read()
+            width, height, _, _ = _turbojpeg.decode_header(jpeg)
+            factor = 1
+            while factor < 8 and max(width, height) // (factor * 2) >= FRAME_DECODE_SIZE:
+                factor *= 2
+            return _turbojpeg.decode(jpeg, pixel_format=TJPF_RGB, scaling_factor=(1, factor))
+        except OSError:
+            pass  # not a JPEG
+    
+    # draft() applies the same DCT scaling to JPEGs in PIL. It keeps both sides at least the
+    # requested size, so ask for the aspect-preserving target
+    image = Image.open(image_path)
+    scale = FRAME_DECODE_SIZE / max(image.size)
+    image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    return np.asarray(image.convert("RGB"))
+
+def decode_jpeg_batch_on_device(image_paths: List[str], device: str) -> torch.Tensor:
+    """Decode a batch of same-sized JPEGs straight into a uint8 (B, 3, H, W) tensor with NVJPEG"""
+    from torchvision.io import decode_jpeg, read_file
+    
+    data = [read_file(str(path)) for path in image_paths]
+    return torch.stack(decode_jpeg(data, device=device))
+
+def iter_video_frames(video_path: str, interval: int = 1):
+    """Decode a video in-process with PyAV, yielding (timestamp, RGB frame) every `interval` seconds.
+    
+    Frames are scaled down to fit FRAME_DECODE_SIZE during the colorspace conversion, so full-resolution
+    RGB frames never exist in memory. Timestamps are the frames' real presentation times, so gaps in
+    the stream do not shift later frames.
+    """
+    import av
+    
+    with av.open(str(video_path)) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        frame_rate = stream.average_rate or stream.guessed_rate
+        # Timestamps are relative to the stream start, like the transcript and ffmpeg's -ss
+        origin = float(stream.start_time * stream.time_base) if stream.start_time is not None else 0.0
+        
+        next_time = 0.0
+        untimed = 0
+        target_size = None
+        for index, frame in enumerate(container.decode(stream)):
+            timestamp = frame.time - origin if frame.time is not None else None
+            if timestamp is None:
+                if not frame_rate:
+                    untimed += 1
+                    continue
+                # No pts on this frame: estimate from its position in the stream
+                timestamp = float(index / frame_rate)
+            
+            if timestamp < next_time:
+                continue
+            next_time = (math.floor(timestamp / interval) + 1) * interval
+            
+            if target_size is None:
+                # Fixed from the first frame, so a mid-stream resolution change still yields
+                # same-shaped frames that batch together
+                scale = min(1.0, FRAME_DECODE_SIZE / max(frame.width, frame.height))
+                target_size = (max(1, round(frame.width * scale)), max(1, round(frame.height * scale)))
+            
+            yield timestamp, frame.to_ndarray(width=target_size[0], height=target_size[1], format="rgb24")
+        
+        if untimed:
+            logger.warning("Skipped %d frames without timestamps in %s", untimed, video_path)
+
+@torch.no_grad()
+def decode_and_encode_frames(video_path: str, output_dir: str, interval: int = 1, batch_size: int = 32):
+    """Decode frames with PyAV and feed them straight to OpenCLIP, skipping the full-size JPEG round trip.
+    
+    Only small thumbnails are written to disk since the frontend displays a frame for each result.
+    """
+    get_openclip_model()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    os.makedirs(output_dir, exist_ok=True)
+    
+    frame_paths = []
+    timestamps = []
+    all_features = []
+    pending = []
+    
+    def flush():
+        frames = torch.from_numpy(np.stack(pending)).permute(0, 3, 1, 2)
+        batch = preprocess_frames_on_device(frames, device)
+        all_features.extend(encode_preprocessed_batch(batch))
+        pending.clear()
+    
+    for timestamp, frame in iter_video_frames(video_path, interval):
+        # Same naming as ffmpeg's frame_%05d.jpg output; frames already fit the 640px thumbnail size
+        thumb_path = Path(output_dir) / f"frame_{len(frame_paths) + 1:05d}.jpg"
+        Image.fromarray(frame).save(thumb_path, quality=85)
+        frame_paths.append(thumb_path)
+        timestamps.append(timestamp)
+        
+        pending.append(frame)
+        if len(pending) == batch_size:
+            flush()
+            if len(frame_paths) % 320 == 0:
+                logger.debug("Decoded and encoded %d frames...", len(frame_paths))
+    
+    if pending:
+        flush()
+    
+    logger.info("Decoded and encoded %d frames from video", len(frame_paths))
+    return frame_paths, all_features, timestamps
+
+@torch.no_grad()
+def encode_images_nvjpeg(image_paths: List[str], batch_size: int = 32) -> List[np.ndarray]:
+    """GPU path: NVJPEG decode + batched transform, decoding the next batch on a side stream"""
+    device = "cuda"
+    decode_stream = torch.cuda.Stream()
+    
+    def decode(start: int) -> torch.Tensor:
+        with torch.cuda.stream(decode_stream):
+            return decode_jpeg_batch_on_device(image_paths[start:start + batch_size], device)
+    
+    all_features = []
+    next_batch = decode(0) if image_paths else None
+    
+    for i in range(0, len(image_paths), batch_size):
+        torch.cuda.current_stream().wait_stream(decode_stream)
+        images = next_batch
+        images.record_stream(torch.cuda.current_stream())
+        
+        # Queue the next decode before encoding so the two overlap
+        if i + batch_size < len(image_paths):
+            next_batch = decode(i + batch_size)
+        
+        all_features.extend(encode_preprocessed_batch(preprocess_frames_on_device(images, device)))
+        
+        if (i + batch_size) % 100 == 0:
+            logger.debug("Encoded %d/%d frames...", min(i + batch_size, len(image_paths)), len(image_paths))
+    
+    return all_features
+
 @torch.no_grad()
 def encode_multiple_images_batch(image_paths: List[str], batch_size: int = 32) -> List[np.ndarray]:
     """Encode multiple images in batches"""
-    model, preprocess, _ = get_openclip_model()
+    get_openclip_model()
     device = "cuda" if torch.cuda.is_available() else "cpu"
     
+    if device == "cuda":
+        try:
+            return encode_images_nvjpeg(image_paths, batch_size)
+        except Exception as e:
+            logger.warning("NVJPEG decode unavailable, preprocessing on CPU: %s", e)
+    
     all_features = []
     
     for i in range(0, len(image_paths), batch_size):
@@ -346,43 +1360,26 @@ def encode_multiple_images_batch(image_paths: List[str], batch_size: int = 32) -
         
         for path in batch_paths:
             try:
-                image = Image.open(path).convert("RGB")
-                images.append(preprocess(image))
+                images.append(torch.from_numpy(decode_image_rgb(path)).permute(2, 0, 1))
             except Exception as e:
-                print(f"Error loading image {path}: {e}")
+                logger.warning("Error loading image %s: %s", path, e)
                 continue
         
         if not images:
             continue
         
-        # Stack images into batch
-        image_batch = torch.stack(images).to(device)
-        
-        # Encode batch
-        features = model.encode_image(image_batch)
-        features = features / features.norm(dim=-1, keepdim=True)
-        
-        all_features.extend(features.cpu().numpy())
+        # Frames of one video share a size, so the batch is transformed in one go
+        if len({image.shape for image in images}) == 1:
+            image_batch = preprocess_frames_on_device(torch.stack(images), device)
+        else:
+            image_batch = torch.cat([preprocess_frames_on_device(image.unsqueeze(0), device) for image in images])
+        all_features.extend(encode_preprocessed_batch(image_batch))
         
         if (i + batch_size) % 100 == 0:
-            print(f"Encoded {min(i + batch_size, len(image_paths))}/{len(image_paths)} frames...")
+            logger.debug("Encoded %d/%d frames...", min(i + batch_size, len(image_paths)), len(image_paths))
     
     return all_features
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    """Calculate cosine similarity between two vectors"""
-    a_np = np.array(a)
-    b_np = np.array(b)
-    
-    dot_product = np.dot(a_np, b_np)
-    norm_a = np.linalg.norm(a_np)
-    norm_b = np.linalg.norm(b_np)
-    
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-    
-    return float(dot_product / (norm_a * norm_b))
-
 def download_youtube_video(url: str, output_path: str) -> str:
     """Download YouTube video using yt-dlp"""
     try:
@@ -399,7 +1396,7 @@ def download_youtube_video(url: str, output_path: str) -> str:
             url
         ]
         
-        print(f"Downloading YouTube video to: {output_path_abs}")
+        logger.info("Downloading YouTube video to: %s", output_path_abs)
         
         result = subprocess.run(
             cmd,
@@ -415,7 +1412,7 @@ def download_youtube_video(url: str, output_path: str) -> str:
         if not Path(output_path_abs).exists():
             raise Exception(f"Downloaded file not found at: {output_path_abs}")
         
-        print(f"Successfully downloaded to: {output_path_abs}")
+        logger.info("Successfully downloaded to: %s", output_path_abs)
         return output_path_abs
         
     except FileNotFoundError:
@@ -429,12 +1426,12 @@ def download_youtube_video(url: str, output_path: str) -> str:
             detail="YouTube download timed out"
         )
     except Exception as e:
-        print(f"Download error: {e}")
+        logger.error("Download error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
-def create_clip(video_path: str, start: float, end: float, output_path: str):
+async def create_clip(video_path: str, start: float, end: float, output_path: str):
     """Create video clip from start to end time"""
-    if not check_ffmpeg():
+    if not await check_ffmpeg():
         raise Exception("FFmpeg not installed")
     
     duration = end - start
@@ -451,15 +1448,15 @@ def create_clip(video_path: str, start: float, end: float, output_path: str):
     ]
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+        result = await run_ffmpeg(cmd, timeout=120)
         if result.returncode != 0:
             raise Exception(f"Clip creation failed: {result.stderr}")
     except subprocess.TimeoutExpired:
         raise Exception("Clip creation timed out")
 
-def create_clip_preview(video_path: str, start: float, end: float) -> bytes:
+async def create_clip_preview(video_path: str, start: float, end: float) -> bytes:
     """Create a low-quality preview clip in memory"""
-    if not check_ffmpeg():
+    if not await check_ffmpeg():
         raise Exception("FFmpeg not installed")
     
     duration = end - start
@@ -483,7 +1480,7 @@ def create_clip_preview(video_path: str, start: float, end: float) -> bytes:
             temp_path, "-y"
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        result = await run_ffmpeg(cmd, timeout=60)
         if result.returncode != 0:
             raise Exception(f"Preview creation failed: {result.stderr}")
         
@@ -501,7 +1498,7 @@ def create_clip_preview(video_path: str, start: float, end: float) -> bytes:
 # API Endpoints
 @app.get("/")
 async def root():
-    ffmpeg_status = "installed" if check_ffmpeg() else "not installed"
+    ffmpeg_status = "installed" if await check_ffmpeg() else "not installed"
     
     try:
         import open_clip
@@ -543,7 +1540,7 @@ async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "ffmpeg": check_ffmpeg(),
+        "ffmpeg": await check_ffmpeg(),
         "device": "cuda" if torch.cuda.is_available() else "cpu"
     }
 
@@ -551,7 +1548,7 @@ async def health_check():
 async def rate_limit_status(request: Request):
     """Get rate limit status for current IP"""
     client_ip = request.client.host
-    remaining = get_rate_limit_remaining(client_ip)
+    remaining = await get_rate_limit_remaining(client_ip)
     
     return {
         "remaining": remaining,
@@ -564,7 +1561,7 @@ async def upload_video(request: Request, file: UploadFile = File(...)):
     """Upload and process video file"""
     client_ip = request.client.host
     
-    remaining = get_rate_limit_remaining(client_ip)
+    remaining = await get_rate_limit_remaining(client_ip)
     if remaining <= 0:
         raise HTTPException(
             status_code=429,
@@ -580,25 +1577,54 @@ async def upload_video(request: Request, file: UploadFile = File(...)):
             detail="Invalid file format. Supported: mp4, avi, mov, mkv, webm"
         )
     
-    video_id = generate_video_id(file.filename)
-    video_path = UPLOAD_DIR / f"{video_id}.mp4"
+    # Stream to a temporary file, hashing as we go; the video ID is derived from the content
+    temp_path = UPLOAD_DIR / f"{generate_video_id(file.filename)}.upload"
+    hasher = hashlib.blake2b(digest_size=8)
     
     try:
-        content = await file.read()
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large. Max size: {MAX_FILE_SIZE // (1024*1024)}MB"
-            )
-        
-        with open(video_path, "wb") as f:
-            f.write(content)
-        
-        print(f"Uploaded video saved to: {video_path}")
-        
+        total_size = 0
+        async with aiofiles.open(temp_path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                total_size += len(chunk)
+                if total_size > MAX_FILE_SIZE:
+                    # Reject as soon as the limit is crossed instead of after the whole body
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Max size: {MAX_FILE_SIZE // (1024*1024)}MB"
+                    )
+                hasher.update(chunk)
+                await out.write(chunk)
+        
+    except HTTPException:
+        temp_path.unlink(missing_ok=True)
+        raise
     except Exception as e:
+        temp_path.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
     
+    video_id = hasher.hexdigest()
+    video_path = UPLOAD_DIR / f"{video_id}.mp4"
+    
+    # Identical bytes were uploaded before: reuse the in-flight or completed processing.
+    # A "processing" status on disk with no pipeline in this process is left over from a restart,
+    # so that video is processed again. No await between this check and marking the id below.
+    cache_file = CACHE_DIR / f"{video_id}.json"
+    if video_id in processing_videos or (
+        video_path.exists() and cache_file.exists() and read_json(cache_file).get("status") == "completed"
+    ):
+        temp_path.unlink(missing_ok=True)
+        logger.info("Duplicate upload of %s, reusing processed data", video_id)
+        return {
+            "video_id": video_id,
+            "filename": file.filename,
+            "message": "Identical video already uploaded. Reusing processed results.",
+            "remaining_uploads": remaining
+        }
+    
+    processing_videos.add(video_id)
+    os.replace(temp_path, video_path)
+    logger.info("Uploaded video saved to: %s", video_path)
+    
     asyncio.create_task(process_video_background(video_id, str(video_path)))
     
     return {
@@ -614,14 +1640,14 @@ async def upload_youtube_url(request: Request, url: str):
     client_ip = request.client.host
     
     # FIX: Actually consume the rate limit by calling check_rate_limit()
-    if not check_rate_limit(client_ip):
+    if not await check_rate_limit(client_ip):
         raise HTTPException(
             status_code=429,
             detail=f"Rate limit exceeded. Limit: {RATE_LIMIT}/day"
         )
     
     # Now get the remaining count (already decremented by check_rate_limit)
-    remaining = get_rate_limit_remaining(client_ip)
+    remaining = await get_rate_limit_remaining(client_ip)
     
     if not url.strip():
         raise HTTPException(status_code=400, detail="URL cannot be empty")
@@ -631,8 +1657,7 @@ async def upload_youtube_url(request: Request, url: str):
     
     cache_file = CACHE_DIR / f"{video_id}.json"
     status = {"status": "downloading", "progress": 0.05, "message": "Downloading from YouTube..."}
-    with open(cache_file, "w") as f:
-        json.dump(status, f)
+    write_json(cache_file, status)
     
     asyncio.create_task(download_and_process_youtube(video_id, url, str(video_path)))
     
@@ -649,102 +1674,116 @@ async def download_and_process_youtube(video_id: str, url: str, video_path: str)
     
     try:
         status = {"status": "downloading", "progress": 0.1, "message": "Downloading YouTube video..."}
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
+        write_json(cache_file, status)
         
         downloaded_path = download_youtube_video(url, video_path)
         await process_video_background(video_id, downloaded_path)
         
     except Exception as e:
-        print(f"YouTube download error: {e}")
+        logger.error("YouTube download error: %s", e)
         status = {
             "status": "error",
             "progress": 0,
             "message": f"Download failed: {str(e)}"
         }
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
+        write_json(cache_file, status)
 
 async def process_video_background(video_id: str, video_path: str):
     """Background task to process video"""
     cache_file = CACHE_DIR / f"{video_id}.json"
     
     try:
-        if not check_ffmpeg():
+        if not await check_ffmpeg():
             raise Exception("FFmpeg not installed")
         
-        # Step 1: Extract audio
-        status = {"status": "processing", "progress": 0.15, "message": "Extracting audio..."}
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
+        status = {"status": "processing", "progress": 0.15, "message": "Extracting audio and frames..."}
+        write_json(cache_file, status)
         
-        audio_path = UPLOAD_DIR / f"{video_id}.wav"
-        extract_audio(video_path, str(audio_path))
-        
-        # Step 2: Transcribe audio
-        status["progress"] = 0.3
-        status["message"] = "Transcribing audio with Whisper..."
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
-        
-        segments = transcribe_audio(str(audio_path))
-        
-        # Step 3: Extract frames (EVERY 1 SECOND for better coverage)
-        status["progress"] = 0.45
-        status["message"] = "Extracting frames (every 1 second for accuracy)..."
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
+        def update_status(progress: float, message: str):
+            # Stages finish out of order, so never move the progress bar backwards
+            status["progress"] = max(status["progress"], progress)
+            status["message"] = message
+            write_json(cache_file, status)
         
+        audio_path = UPLOAD_DIR / f"{video_id}.wav"
         frames_dir = UPLOAD_DIR / f"{video_id}_frames"
-        frame_paths = extract_frames(video_path, str(frames_dir), interval=1)
-        
-        # Step 4: Generate text embeddings
-        status["progress"] = 0.55
-        status["message"] = "Generating text embeddings..."
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
         
-        texts = [seg["text"] for seg in segments]
-        text_embeddings = await get_text_embeddings(texts)
-        
-        # Step 5: Generate visual embeddings with OpenCLIP
-        status["progress"] = 0.65
-        status["message"] = "Encoding frames with OpenCLIP..."
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
+        # Audio branch: extract audio -> transcribe -> text embeddings
+        async def process_audio():
+            await extract_audio(video_path, str(audio_path))
+            
+            update_status(0.3, "Transcribing audio with Whisper...")
+            segments = await to_thread_to_completion(transcribe_audio, str(audio_path))
+            
+            update_status(0.55, "Generating text embeddings...")
+            texts = [seg["text"] for seg in segments]
+            text_embeddings = await get_text_embeddings(texts)
+            save_embedding_matrix(video_id, "text", text_embeddings, dim=768)
+            
+            return segments, texts, text_embeddings
         
-        print(f"Encoding {len(frame_paths)} frames with OpenCLIP...")
+        # Visual branch: extract frames (EVERY 1 SECOND for better coverage) -> OpenCLIP embeddings
+        async def process_frames():
+            try:
+                # Decode in-process and encode frames as they come off the decoder
+                return await to_thread_to_completion(
+                    run_on_cuda_stream, decode_and_encode_frames, video_path, str(frames_dir), 1
+                )
+            except ImportError:
+                logger.warning("PyAV not installed - extracting frames with ffmpeg")
+            except Exception as e:
+                from av.error import FFmpegError
+                if not isinstance(e, FFmpegError):
+                    raise
+                # Same retry as a failed NVDEC extraction: start over with the ffmpeg CLI
+                logger.warning("PyAV decode failed, extracting frames with ffmpeg: %s", e)
+                shutil.rmtree(frames_dir, ignore_errors=True)
+            
+            frame_paths = await extract_frames(video_path, str(frames_dir), 1)
+            
+            update_status(0.65, "Encoding frames with OpenCLIP...")
+            logger.info("Encoding %d frames with OpenCLIP...", len(frame_paths))
+            
+            frame_path_strs = [str(fp) for fp in frame_paths]
+            visual_embeddings = await to_thread_to_completion(
+                run_on_cuda_stream, encode_multiple_images_batch, frame_path_strs, 32
+            )
+            # ffmpeg's fps filter duplicates frames across gaps, so frame i is at i seconds
+            return frame_paths, visual_embeddings, [float(i) for i in range(len(frame_paths))]
         
-        frame_path_strs = [str(fp) for fp in frame_paths]
-        visual_embeddings = encode_multiple_images_batch(frame_path_strs, batch_size=32)
+        # The two branches are independent: overlap CPU-bound ffmpeg/decoding with GPU encoders.
+        # If one fails, the TaskGroup cancels the other and waits for it, so nothing keeps running
+        # (or writing status and files) after this pipeline has given up.
+        try:
+            async with asyncio.TaskGroup() as tg:
+                audio_task = tg.create_task(process_audio())
+                frames_task = tg.create_task(process_frames())
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0]
+        segments, texts, text_embeddings = audio_task.result()
+        frame_paths, visual_embeddings, frame_times = frames_task.result()
+        
+        # Persist all frame embeddings as one contiguous (N, D) matrix
+        visual_matrix = save_embedding_matrix(video_id, "visual", visual_embeddings, dim=512)
+        await asyncio.to_thread(build_pq_index, video_id, visual_matrix)
         
         visual_data = []
-        for i, (frame_path, embedding) in enumerate(zip(frame_paths, visual_embeddings)):
-            timestamp = i * 1.0  # 1 second intervals
-            
+        for i, (frame_path, timestamp) in enumerate(zip(frame_paths[:len(visual_matrix)], frame_times)):
             visual_data.append({
                 "timestamp": timestamp,
                 "frame_path": str(frame_path),
-                "frame_number": i,
-                "embedding": embedding.tolist()
+                "frame_number": i
             })
-            
-            if i % 50 == 0:
-                progress = 0.65 + (i / len(frame_paths)) * 0.25
-                status["progress"] = progress
-                status["message"] = f"Encoded {i}/{len(frame_paths)} frames..."
-                with open(cache_file, "w") as f:
-                    json.dump(status, f)
         
-        print(f"Generated {len(visual_data)} visual embeddings")
+        logger.info("Generated %d visual embeddings", len(visual_data))
         
         # Step 6: Store in LanceDB
         status["progress"] = 0.92
         status["message"] = "Storing in LanceDB..."
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
+        write_json(cache_file, status)
         
-        db = get_lancedb()
+        # Table creation and IVF_PQ training block, so they run in worker threads like build_pq_index
+        await asyncio.to_thread(get_lancedb)
         
         # Create text embeddings table
         text_table_name = f"text_{video_id}"
@@ -759,40 +1798,27 @@ async def process_video_background(video_id: str, video_path: str):
             })
         
         if text_data_for_db:
-            try:
-                if text_table_name in db.table_names():
-                    db.drop_table(text_table_name)
-                text_table = db.create_table(text_table_name, data=text_data_for_db)
-                print(f"Created LanceDB text table: {text_table_name}")
-            except Exception as e:
-                print(f"Error creating text table: {e}")
+            await asyncio.to_thread(store_vector_table, text_table_name, text_data_for_db)
         
         # Create visual embeddings table
         visual_table_name = f"visual_{video_id}"
         visual_data_for_db = []
-        for vd in visual_data:
+        for vd, embedding in zip(visual_data, visual_matrix):
             visual_data_for_db.append({
                 "video_id": video_id,
                 "timestamp": vd["timestamp"],
                 "frame_path": vd["frame_path"],
                 "frame_number": vd["frame_number"],
-                "vector": vd["embedding"]
+                "vector": embedding.astype(np.float32)
             })
         
         if visual_data_for_db:
-            try:
-                if visual_table_name in db.table_names():
-                    db.drop_table(visual_table_name)
-                visual_table = db.create_table(visual_table_name, data=visual_data_for_db)
-                print(f"Created LanceDB visual table: {visual_table_name}")
-            except Exception as e:
-                print(f"Error creating visual table: {e}")
+            await asyncio.to_thread(store_vector_table, visual_table_name, visual_data_for_db)
         
         # Store processed data
         processed_data = {
             "video_id": video_id,
             "segments": segments,
-            "text_embeddings": text_embeddings,
             "visual_data": visual_data,
             "frames_dir": str(frames_dir),
             "video_path": video_path,
@@ -805,34 +1831,33 @@ async def process_video_background(video_id: str, video_path: str):
         }
         
         data_file = CACHE_DIR / f"{video_id}_data.json"
-        with open(data_file, "w") as f:
-            json.dump(processed_data, f)
+        write_json(data_file, processed_data)
+        video_data_cache.pop(video_id, None)
         
         # Complete
         status["status"] = "completed"
         status["progress"] = 1.0
         status["message"] = "Processing complete! Visual/Text/Hybrid search ready."
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
+        write_json(cache_file, status)
         
         # Cleanup audio file
         if audio_path.exists():
             os.remove(audio_path)
         
-        print(f"Successfully processed video: {video_id}")
+        logger.info("Successfully processed video: %s", video_id)
             
     except Exception as e:
-        print(f"Processing error for {video_id}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Processing error for %s: %s", video_id, e)
         
-        status = {
+        error_status = {
             "status": "error",
             "progress": 0,
             "message": f"Processing failed: {str(e)}"
         }
-        with open(cache_file, "w") as f:
-            json.dump(status, f)
+        write_json(cache_file, error_status)
+    
+    finally:
+        processing_videos.discard(video_id)
 
 @app.get("/status/{video_id}")
 async def get_status(video_id: str):
@@ -846,115 +1871,120 @@ async def get_status(video_id: str):
             "message": "Video not found"
         }
     
-    with open(cache_file, "r") as f:
-        status = json.load(f)
+    status = read_json(cache_file)
     
     return status
 
+def merge_hybrid_results(text_results: List[dict], visual_results: List[dict]) -> List[dict]:
+    """Merge hybrid results by half-second bucket, keeping the best text and best visual hit per bucket.
+    
+    When both are present and within HYBRID_SCORE_MARGIN of each other both are kept, so the UI
+    still sees the two modalities; otherwise only the higher-scoring one survives.
+    """
+    buckets = {}
+    for slot, source in ((0, text_results), (1, visual_results)):
+        for r in source:
+            best = buckets.setdefault(int(r["timestamp"] * 2), [None, None])
+            if best[slot] is None or best[slot]["score"] < r["score"]:
+                best[slot] = r
+    
+    merged = []
+    for text_best, visual_best in buckets.values():
+        if text_best is None or visual_best is None:
+            merged.append(text_best or visual_best)
+        elif abs(text_best["score"] - visual_best["score"]) <= HYBRID_SCORE_MARGIN:
+            merged.extend((text_best, visual_best))
+        else:
+            merged.append(max(text_best, visual_best, key=itemgetter("score")))
+    return merged
+
 @app.post("/search")
 async def search_video(query: SearchQuery):
     """IMPROVED search with proper visual/text/hybrid separation"""
-    data_file = CACHE_DIR / f"{query.video_id}_data.json"
+    data = load_video_data(query.video_id)
     
-    if not data_file.exists():
+    if data is None:
         raise HTTPException(status_code=404, detail="Video not processed yet")
     
-    with open(data_file, "r") as f:
-        data = json.load(f)
-    
     results = []
     
     # === TEXT SEARCH ONLY ===
     if query.search_type == "text":
-        print(f"=== TEXT SEARCH for: '{query.query}' ===")
+        logger.debug("=== TEXT SEARCH for: '%s' ===", query.query)
         try:
             # Get query embedding for text
-            query_embeddings = await get_text_embeddings([query.query])
-            query_embedding = query_embeddings[0]
+            query_embedding = await get_query_text_embedding(query.query)
             
-            # Search in text segments using in-memory data
+            # ANN candidates from the LanceDB text table (full scan if unavailable)
             text_segments = data.get("segments", [])
-            text_embeddings = data.get("text_embeddings", [])
+            seg_indices, combined_scores = search_text_segments(
+                data, query_embedding, query.query, query.top_k * 4
+            )
             
-            for i, seg in enumerate(text_segments):
-                if i >= len(text_embeddings):
-                    continue
-                    
-                # Calculate similarity
-                similarity = cosine_similarity(query_embedding, text_embeddings[i])
-                
-                # Check for keyword matches
-                query_lower = query.query.lower()
-                text_lower = seg["text"].lower()
-                keyword_bonus = 0.0
-                if query_lower in text_lower:
-                    keyword_bonus = 0.3
-                
-                combined_score = similarity + keyword_bonus
-                
-                if combined_score > 0.3:  # Only include relevant matches
-                    results.append({
-                        "timestamp": seg["start"],
-                        "text": seg["text"],
-                        "score": min(combined_score, 1.0),
-                        "search_type": "text",
-                        "end": seg["end"]
-                    })
+            matches = np.nonzero(combined_scores > 0.3)[0]  # Only include relevant matches
+            matches = matches[top_k_indices(combined_scores[matches], query.top_k * 2)]
             
-            print(f"Found {len(results)} text matches")
+            for j in matches:
+                seg = text_segments[seg_indices[j]]
+                results.append({
+                    "timestamp": seg["start"],
+                    "text": seg["text"],
+                    "score": min(float(combined_scores[j]), 1.0),
+                    "search_type": "text",
+                    "end": seg["end"]
+                })
+            
+            logger.debug("Found %d text matches", len(results))
                     
         except Exception as e:
-            print(f"Text search error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Text search error: %s", e)
     
     # === VISUAL SEARCH ONLY ===
     elif query.search_type == "visual":
-        print(f"=== VISUAL SEARCH for: '{query.query}' ===")
+        logger.debug("=== VISUAL SEARCH for: '%s' ===", query.query)
         try:
             # Step 1: Encode the query text using CLIP text encoder
-            print("Encoding query with CLIP text encoder...")
-            query_visual_embedding = encode_text_with_openclip(query.query)
-            print(f"Query embedding shape: {query_visual_embedding.shape}")
+            logger.debug("Encoding query with CLIP text encoder...")
+            query_visual_embedding = await get_query_clip_embedding(query.query)
+            logger.debug("Query embedding shape: %s", query_visual_embedding.shape)
             
-            # Step 2: Compare with all frame embeddings
-            visual_data = data.get("visual_data", [])
-            print(f"Searching through {len(visual_data)} frames...")
+            # Step 2: ANN query against the LanceDB visual table
+            visual_table_name = data.get("visual_table_name", f"visual_{query.video_id}")
+            top_matches = search_vector_table(visual_table_name, query_visual_embedding, query.top_k * 2)
             
-            visual_matches = []
-            for vd in visual_data:
-                # Calculate cosine similarity
-                frame_embedding = np.array(vd["embedding"])
-                similarity = cosine_similarity(
-                    query_visual_embedding.tolist(), 
-                    frame_embedding.tolist()
-                )
+            if top_matches is None:
+                # Fallback: brute-force scan of the frame embedding matrix
+                visual_matrix = data["visual_matrix"]
+                if visual_matrix is None:
+                    raise Exception("Frame embeddings not found")
+                logger.debug("Searching through %d frames...", len(visual_matrix))
                 
-                visual_matches.append({
-                    "timestamp": vd["timestamp"],
-                    "frame_number": vd["frame_number"],
-                    "frame_path": vd["frame_path"],
-                    "similarity": similarity
-                })
-            
-            # Sort by similarity
-            visual_matches.sort(key=lambda x: x["similarity"], reverse=True)
-            
-            # Take top matches
-            top_matches = visual_matches[:query.top_k * 2]
+                top_idx, top_scores = top_k_frames(
+                    visual_matrix, query_visual_embedding, query.top_k * 2,
+                    pq_index=data["visual_pq"], gpu_matrix=get_visual_matrix_gpu(data)
+                )
+                frame_timestamps = data["frame_timestamps"][top_idx].tolist()
+                frame_numbers = data["frame_numbers"][top_idx].tolist()
+                frame_paths = data["frame_paths"]
+                top_matches = [
+                    {
+                        "timestamp": timestamp,
+                        "frame_number": frame_number,
+                        "frame_path": frame_paths[idx],
+                        "similarity": similarity
+                    }
+                    for idx, timestamp, frame_number, similarity
+                    in zip(top_idx.tolist(), frame_timestamps, frame_numbers, top_scores.tolist())
+                ]
             
             if top_matches:
-                print(f"Top match similarity: {top_matches[0]['similarity']:.3f} at {top_matches[0]['timestamp']}s")
+                logger.debug("Top match similarity: %.3f at %ss", top_matches[0]['similarity'], top_matches[0]['timestamp'])
             
             # Convert to results
             for match in top_matches:
                 # Find corresponding text segment
                 timestamp = match["timestamp"]
-                corresponding_text = f"Visual content at {timestamp:.1f}s"
-                for seg in data.get("segments", []):
-                    if seg["start"] <= timestamp <= seg["end"]:
-                        corresponding_text = seg["text"]
-                        break
+                corresponding_text = segment_text_at(data, timestamp)
                 
                 results.append({
                     "timestamp": timestamp,
@@ -967,109 +1997,104 @@ async def search_video(query: SearchQuery):
                     "end": timestamp + 1
                 })
             
-            print(f"Returning {len(results)} visual matches")
+            logger.debug("Returning %d visual matches", len(results))
                     
         except Exception as e:
-            print(f"Visual search error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Visual search error: %s", e)
     
     # === HYBRID SEARCH ===
     else:  # hybrid
-        print(f"=== HYBRID SEARCH for: '{query.query}' ===")
+        logger.debug("=== HYBRID SEARCH for: '%s' ===", query.query)
         
         # Run both searches
         text_results = []
         visual_results = []
         
+        # The two encoders are independent: run them concurrently, so latency is the max rather than the sum
+        text_task = asyncio.create_task(get_query_text_embedding(query.query))
+        visual_task = asyncio.create_task(get_query_clip_embedding(query.query))
+        query_embedding, query_visual_embedding = await asyncio.gather(
+            text_task, visual_task, return_exceptions=True
+        )
+        
         # Text search
         try:
-            query_embeddings = await get_text_embeddings([query.query])
-            query_embedding = query_embeddings[0]
+            if isinstance(query_embedding, BaseException):
+                raise query_embedding
             
             text_segments = data.get("segments", [])
-            text_embeddings = data.get("text_embeddings", [])
+            seg_indices, combined_scores = search_text_segments(
+                data, query_embedding, query.query, query.top_k * 4
+            )
             
-            for i, seg in enumerate(text_segments):
-                if i >= len(text_embeddings):
-                    continue
-                    
-                similarity = cosine_similarity(query_embedding, text_embeddings[i])
-                
-                query_lower = query.query.lower()
-                text_lower = seg["text"].lower()
-                keyword_bonus = 0.3 if query_lower in text_lower else 0.0
-                
-                combined_score = similarity + keyword_bonus
-                
-                if combined_score > 0.4:  # Higher threshold for hybrid to reduce noise
-                    text_results.append({
-                        "timestamp": seg["start"],
-                        "text": seg["text"],
-                        "score": min(combined_score, 1.0) * 0.5,  # Weight text at 50%
-                        "search_type": "text",
-                        "end": seg["end"]
-                    })
+            matches = np.nonzero(combined_scores > 0.4)[0]  # Higher threshold for hybrid to reduce noise
+            matches = matches[top_k_indices(combined_scores[matches], query.top_k * 2)]
+            
+            for j in matches:
+                seg = text_segments[seg_indices[j]]
+                text_results.append({
+                    "timestamp": seg["start"],
+                    "text": seg["text"],
+                    "score": min(float(combined_scores[j]), 1.0) * 0.5,  # Weight text at 50%
+                    "search_type": "text",
+                    "end": seg["end"]
+                })
                     
         except Exception as e:
-            print(f"Hybrid text search error: {e}")
+            logger.exception("Hybrid text search error: %s", e)
         
         # Visual search
         try:
-            query_visual_embedding = encode_text_with_openclip(query.query)
-            visual_data = data.get("visual_data", [])
+            if isinstance(query_visual_embedding, BaseException):
+                raise query_visual_embedding
             
-            for vd in visual_data:
-                frame_embedding = np.array(vd["embedding"])
-                similarity = cosine_similarity(
-                    query_visual_embedding.tolist(), 
-                    frame_embedding.tolist()
-                )
+            visual_matrix = data["visual_matrix"]
+            if visual_matrix is None:
+                raise Exception("Frame embeddings not found")
+            
+            # Exact scan (GPU, fused numba kernel or NumPy), keeping only the best frames over the threshold
+            survivors, scores = top_k_frames(
+                visual_matrix, query_visual_embedding, query.top_k * 2,
+                gpu_matrix=get_visual_matrix_gpu(data), threshold=0.25  # Higher threshold for hybrid
+            )
+            for similarity, timestamp, frame_number in zip(
+                scores.tolist(),
+                data["frame_timestamps"][survivors].tolist(),
+                data["frame_numbers"][survivors].tolist()
+            ):
+                corresponding_text = segment_text_at(data, timestamp)
                 
-                if similarity > 0.25:  # Higher threshold for hybrid
-                    timestamp = vd["timestamp"]
-                    corresponding_text = f"Visual content at {timestamp:.1f}s"
-                    for seg in data.get("segments", []):
-                        if seg["start"] <= timestamp <= seg["end"]:
-                            corresponding_text = seg["text"]
-                            break
-                    
-                    visual_results.append({
-                        "timestamp": timestamp,
-                        "text": corresponding_text,
-                        "score": similarity * 0.5,  # Weight visual at 50%
-                        "search_type": "visual",
-                        "frame_url": f"/frame/{query.video_id}/{vd['frame_number']}",
-                        "clip_score": round(similarity, 3),
-                        "end": timestamp + 1
-                    })
+                visual_results.append({
+                    "timestamp": timestamp,
+                    "text": corresponding_text,
+                    "score": similarity * 0.5,  # Weight visual at 50%
+                    "search_type": "visual",
+                    "frame_url": f"/frame/{query.video_id}/{frame_number}",
+                    "clip_score": round(similarity, 3),
+                    "end": timestamp + 1
+                })
                     
         except Exception as e:
-            print(f"Hybrid visual search error: {e}")
+            logger.exception("Hybrid visual search error: %s", e)
         
-        # Combine results
-        results = text_results + visual_results
-    
-    # Sort by score
-    results.sort(key=lambda x: x["score"], reverse=True)
+        # Combine results: at most one text and one visual result per half-second window
+        candidates = merge_hybrid_results(text_results, visual_results)
     
-    # Remove duplicates (keep highest score for same timestamp)
-    seen_timestamps = {}
-    unique_results = []
-    for r in results:
-        ts = round(r["timestamp"], 1)
-        if ts not in seen_timestamps or seen_timestamps[ts] < r["score"]:
-            if ts in seen_timestamps:
-                unique_results = [ur for ur in unique_results if round(ur["timestamp"], 1) != ts]
-            seen_timestamps[ts] = r["score"]
-            unique_results.append(r)
+    if query.search_type != "hybrid":
+        # Remove duplicates in one pass (keep highest score for same timestamp)
+        # (keyed by tenths of a second with integer arithmetic; round() on floats is slow)
+        best_by_ts = {}
+        for r in results:
+            ts = int(r["timestamp"] * 10)
+            current = best_by_ts.get(ts)
+            if current is None or current["score"] < r["score"]:
+                best_by_ts[ts] = r
+        candidates = best_by_ts.values()
     
-    unique_results.sort(key=lambda x: x["score"], reverse=True)
+    # Only the top_k survivors need ordering
+    unique_results = heapq.nlargest(query.top_k, candidates, key=itemgetter("score"))
     
     # Store in search history
-    if query.video_id not in search_history:
-        search_history[query.video_id] = []
-    
     search_history[query.video_id].append({
         "query": query.query,
         "search_type": query.search_type,
@@ -1079,45 +2104,48 @@ async def search_video(query: SearchQuery):
     })
     
     return {
-        "results": unique_results[:query.top_k],
-        "total_matches": len(unique_results),
+        "results": unique_results,
+        "total_matches": len(candidates),
         "search_type": query.search_type,
         "model": "OpenCLIP ViT-B-32 + LAION-2B + Sentence-Transformers"
     }
 
 @app.get("/frame/{video_id}/{frame_number}")
-async def get_frame(video_id: str, frame_number: int):
-    """Get specific frame image"""
-    data_file = CACHE_DIR / f"{video_id}_data.json"
+async def get_frame(video_id: str, frame_number: int, request: Request):
+    """Get specific frame image (immutable once extracted, so clients may cache it)"""
+    # Frames never change for a given video id (it is a content hash), so the ETag needs no file stat
+    etag = f'"{video_id}-{frame_number}"'
+    cache_headers = {"Cache-Control": FRAME_CACHE_CONTROL, "ETag": etag}
     
-    if not data_file.exists():
-        raise HTTPException(status_code=404, detail="Video not found")
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=cache_headers)
     
-    with open(data_file, "r") as f:
-        data = json.load(f)
+    data = load_video_data(video_id)
     
-    frames_dir = Path(data["frames_dir"])
-    frame_path = frames_dir / f"frame_{frame_number:05d}.jpg"
+    if data is None:
+        raise HTTPException(status_code=404, detail="Video not found")
     
-    if not frame_path.exists():
+    # frames_dir comes from the in-memory video cache
+    frame_path = os.path.join(data["frames_dir"], f"frame_{frame_number:05d}.jpg")
+    
+    if not os.path.isfile(frame_path):
         raise HTTPException(status_code=404, detail="Frame not found")
     
-    return FileResponse(frame_path, media_type="image/jpeg")
+    # FileResponse streams the file (sendfile where available); our ETag replaces its stat-based one
+    return FileResponse(frame_path, media_type="image/jpeg", headers=cache_headers)
 
 @app.get("/search-history/{video_id}")
 async def get_search_history(video_id: str):
     """Get search history for a video"""
     return {
         "video_id": video_id,
-        "history": search_history.get(video_id, [])
+        "history": list(search_history.get(video_id, ()))
     }
 
 @app.post("/bookmarks")
 async def add_bookmark(bookmark: BookmarkRequest):
     """Add a bookmark"""
-    if bookmark.video_id not in bookmarks:
-        bookmarks[bookmark.video_id] = []
-    
     bookmarks[bookmark.video_id].append({
         "timestamp": bookmark.timestamp,
         "note": bookmark.note,
@@ -1131,26 +2159,33 @@ async def get_bookmarks(video_id: str):
     """Get all bookmarks for a video"""
     return {
         "video_id": video_id,
-        "bookmarks": bookmarks.get(video_id, [])
+        "bookmarks": list(bookmarks.get(video_id, ()))
     }
 
 @app.post("/create-clip")
 async def create_video_clip(clip_req: ClipRequest):
     """Create and download video clip"""
-    data_file = CACHE_DIR / f"{clip_req.video_id}_data.json"
+    data = load_video_data(clip_req.video_id)
     
-    if not data_file.exists():
+    if data is None:
         raise HTTPException(status_code=404, detail="Video not found")
     
-    with open(data_file, "r") as f:
-        data = json.load(f)
-    
     video_path = data["video_path"]
     clip_filename = f"clip_{clip_req.video_id}_{int(clip_req.start_time)}_{int(clip_req.end_time)}.mp4"
     clip_path = CLIPS_DIR / clip_filename
     
+    # Identical requests (same output file) await one ffmpeg run instead of racing on the same path
+    job = clip_jobs.get(clip_filename)
+    if job is None:
+        job = asyncio.ensure_future(
+            create_clip(video_path, clip_req.start_time, clip_req.end_time, str(clip_path))
+        )
+        clip_jobs[clip_filename] = job
+        job.add_done_callback(lambda _: clip_jobs.pop(clip_filename, None))
+    
     try:
-        create_clip(video_path, clip_req.start_time, clip_req.end_time, str(clip_path))
+        # Shielded so a client disconnecting doesn't cancel the run for the other waiters
+        await asyncio.shield(job)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Clip creation failed: {str(e)}")
     
@@ -1163,14 +2198,11 @@ async def create_video_clip(clip_req: ClipRequest):
 @app.get("/preview-clip/{video_id}")
 async def preview_clip(video_id: str, start_time: float, end_time: float):
     """Generate and stream a preview of the clip"""
-    data_file = CACHE_DIR / f"{video_id}_data.json"
+    data = load_video_data(video_id)
     
-    if not data_file.exists():
+    if data is None:
         raise HTTPException(status_code=404, detail="Video not found")
     
-    with open(data_file, "r") as f:
-        data = json.load(f)
-    
     video_path = data["video_path"]
     
     # Check cache
@@ -1179,7 +2211,7 @@ async def preview_clip(video_id: str, start_time: float, end_time: float):
         video_bytes = clip_preview_cache[cache_key]
     else:
         try:
-            video_bytes = create_clip_preview(video_path, start_time, end_time)
+            video_bytes = await create_clip_preview(video_path, start_time, end_time)
             # Cache the preview (limit cache size)
             if len(clip_preview_cache) > 20:
                 # Remove oldest entry
@@ -1200,17 +2232,20 @@ async def preview_clip(video_id: str, start_time: float, end_time: float):
 @app.get("/download-clip/{filename}")
 async def download_clip(filename: str):
     """Download created clip"""
-    clip_path = CLIPS_DIR / filename
+    # Resolve against the precomputed root and refuse anything that escapes it (e.g. "../")
+    clip_path = (CLIPS_ROOT / filename).resolve()
+    if not clip_path.is_relative_to(CLIPS_ROOT):
+        raise HTTPException(status_code=400, detail="Invalid clip filename")
     
-    if not clip_path.exists():
+    if not clip_path.is_file():
         raise HTTPException(status_code=404, detail="Clip not found")
     
     return FileResponse(
         clip_path,
         media_type="video/mp4",
-        filename=filename,
+        filename=clip_path.name,
         headers={
-            "Content-Disposition": f"attachment; filename={filename}"
+            "Content-Disposition": f"attachment; filename={clip_path.name}"
         }
     )
 
@@ -1227,19 +2262,16 @@ async def get_video(video_id: str):
 @app.get("/video-info/{video_id}")
 async def get_video_info(video_id: str):
     """Get video metadata"""
-    data_file = CACHE_DIR / f"{video_id}_data.json"
+    data = load_video_data(video_id)
     
-    if not data_file.exists():
+    if data is None:
         raise HTTPException(status_code=404, detail="Video not found")
     
-    with open(data_file, "r") as f:
-        data = json.load(f)
-    
     return {
         "video_id": video_id,
         "duration": data.get("duration", 0),
         "segments_count": len(data.get("segments", [])),
-        "frames_count": len(data.get("visual_data", [])),
+        "frames_count": len(data["frame_paths"]),
         "frame_interval": data.get("frame_interval", 1),
         "model": data.get("model", "Unknown"),
         "has_text_search": True,
@@ -1252,7 +2284,10 @@ async def delete_video(video_id: str):
     files_to_delete = [
         UPLOAD_DIR / f"{video_id}.mp4",
         CACHE_DIR / f"{video_id}.json",
-        CACHE_DIR / f"{video_id}_data.json"
+        CACHE_DIR / f"{video_id}_data.json",
+        embedding_matrix_path(video_id, "visual"),
+        embedding_matrix_path(video_id, "text"),
+        pq_index_path(video_id)
     ]
     
     frames_dir = UPLOAD_DIR / f"{video_id}_frames"
@@ -1274,17 +2309,17 @@ async def delete_video(video_id: str):
         if visual_table in db.table_names():
             db.drop_table(visual_table)
     except Exception as e:
-        print(f"Error deleting LanceDB tables: {e}")
+        logger.error("Error deleting LanceDB tables: %s", e)
     
     # Clear cache entries
     cache_keys_to_remove = [k for k in clip_preview_cache.keys() if k.startswith(video_id)]
     for key in cache_keys_to_remove:
         del clip_preview_cache[key]
     
-    if video_id in search_history:
-        del search_history[video_id]
-    if video_id in bookmarks:
-        del bookmarks[video_id]
+    video_data_cache.pop(video_id, None)
+    
+    search_history.pop(video_id, None)
+    bookmarks.pop(video_id, None)
     
     return {"message": "Video and all associated data deleted"}
 